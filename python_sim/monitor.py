@@ -5,7 +5,7 @@ monitor.py: Live ASCII visualization of network simulation events using Rich.
 Reads sim_output.log (produced by sim.py via Tee) and displays a live 4-column view
 showing, for each node:
   - Incoming connectivity (which nodes can reach it)
-  - Last 5 packet events (TX/RX with timestamps)
+  - Last --history packet events (TX/RX with timestamps, default 5)
 """
 import os
 import sys
@@ -13,9 +13,11 @@ import time
 import argparse
 import threading
 import select
+import ctypes
+import ctypes.util
 import termios
 import tty
-from collections import deque
+from bisect import insort
 from collections import deque
 
 try:
@@ -23,138 +25,318 @@ try:
     from rich.panel import Panel
     from rich.columns import Columns
     from rich.text import Text
+    from rich.markup import escape
 except ImportError:
     print("Error: please install rich (pip install rich)", file=sys.stderr)
     sys.exit(1)
 
+# optional: vectorized decode of connectivity matrices
+try:
+    import numpy
+except ImportError:
+    numpy = None
+# byte -> b'1' for b'1', b'0' otherwise; lets int(..., 2) read any matrix
+_BIT_DIGITS = bytes(ord('1') if c == ord('1') else ord('0') for c in range(256))
+
+REFRESH_PER_SECOND = 4
+# events kept per node; only the most recent ones are displayed
+DEFAULT_HISTORY = 5
+# bytes read from the log per syscall while tailing
+READ_SIZE = 65536
+# inotify event mask for "file was written to" (linux/inotify.h)
+IN_MODIFY = 0x2
+# backoff bounds (seconds) when polling without inotify
+POLL_MIN, POLL_MAX = 0.005, 0.1
+
+def _inotify_watch(path):
+    """
+    Return a non-blocking inotify fd watching path for writes,
+    or None where inotify is unavailable (non-Linux).
+    """
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        ifd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if ifd < 0:
+        return None
+    if libc.inotify_add_watch(ifd, os.fsencode(path), IN_MODIFY) < 0:
+        os.close(ifd)
+        return None
+    return ifd
+
 def tail_f(path):
-    with open(path, 'r') as f:
+    with open(path, 'rb') as f:
         f.seek(0, os.SEEK_END)
-        while True:
-            line = f.readline()
-            if not line:
-                time.sleep(0.1)
-                continue
-            yield line.rstrip("\n")
+        fd = f.fileno()
+        notify_fd = _inotify_watch(path)
+        delay = POLL_MIN
+        # bytes after the last newline seen, completed by a later read
+        buf = b""
+        try:
+            while True:
+                chunk = os.read(fd, READ_SIZE)
+                if not chunk:
+                    # signal idle so the caller can react (e.g. check for exit)
+                    yield None
+                    if notify_fd is not None:
+                        # block until the next write (timeout lets callers check for exit)
+                        ready, _, _ = select.select([notify_fd], [], [], 1.0)
+                        if ready:
+                            try:
+                                os.read(notify_fd, 4096)
+                            except BlockingIOError:
+                                pass
+                    else:
+                        time.sleep(delay)
+                        delay = min(delay * 2, POLL_MAX)
+                    continue
+                delay = POLL_MIN
+                *lines, buf = (buf + chunk).split(b"\n")
+                for line in lines:
+                    yield line.decode(errors='replace')
+        finally:
+            if notify_fd is not None:
+                os.close(notify_fd)
 
 class Monitor:
-    def __init__(self):
+    def __init__(self, history=DEFAULT_HISTORY):
         # dynamic list of nodes (populated via 'initialized' events)
         self.nodes = []
-        # unlimited history of events per node: deque of (ts, typ, other)
+        # self.nodes in display order, kept sorted as nodes are added
+        self._sorted_nodes = []
+        # interned name for each known node, used to canonicalize parsed fields;
+        # events for nodes not seen via 'initialized' are ignored
+        self._names = {}
+        # recent events per node, bounded to `history` entries: deque of (ts, typ, other)
+        self.history = history
         self.events = {}
-        # connectivity matrix: for each dst, set of src nodes that can reach it
-        self.connectivity = {}
+        # connectivity matrix: for each dst, bitmask of src nodes that can reach it
+        # (bit i set means self.nodes[i] reaches dst)
+        self.connectivity_mask = {}
+        # rendered "Peers in" markup per dst, dropped when its mask changes
+        self._peers_cache = {}
+        # last decoded matrix as an N x N bool array (numpy only)
+        self._conn_arr = None
+        # (N, matrix) of the last connectivity_update applied
+        self._prev_matrix = None
         # latest state snapshot per node
         # { node: { 'uptime': str, 'entries': [(name,ts,lat,lon), ...] } }
         self.states = {}
         # view mode: 'events' or 'state'
         self.mode = 'events'
+        # rendered Panel per node, rebuilt only for nodes marked dirty
+        self._panel_cache = {}
+        self._panel_mode = None
+        self._dirty_nodes = set()
+        # event kind -> (parse rest-of-line into fields, handler(ts, *fields))
+        self._handlers = {
+            'initialized': (self._split_initialized, self._on_initialized),
+            'connectivity_update': (self._split_connectivity, self._on_connectivity),
+            'tx': (self._split_tx, self._on_tx),
+            'forward': (self._split_forward, self._on_forward),
+            'state': (self._split_state, self._on_state),
+        }
 
     def add_node(self, name):
-        if name in self.nodes:
+        if name in self._names:
             return
+        name = sys.intern(name)
+        self._names[name] = name
         self.nodes.append(name)
-        self.events[name] = deque()
-        self.connectivity[name] = set()
+        insort(self._sorted_nodes, name)
+        self.events[name] = deque(maxlen=self.history)
+        self.connectivity_mask[name] = 0
         self.states[name] = None
+        self._dirty_nodes.add(name)
 
     def parse_line(self, line):
-        parts = line.split(',', 2)
-        if len(parts) < 2:
+        """Apply one CSV line from sim_output.log."""
+        # partition returns fixed 3-tuples, avoiding a list per split
+        ts_s, sep, rest = line.partition(',')
+        if not sep:
+            return
+        ev, _, payload = rest.partition(',')
+        # drop unknown event kinds before paying for float()
+        handler = self._handlers.get(ev)
+        if handler is None:
             return
-        ts_s, ev = parts[0], parts[1]
         try:
             ts = float(ts_s)
         except ValueError:
             return
-        # handle node initialization
-        if ev == 'initialized':  # format: ts,initialized,NODx
-            name = parts[2]
-            self.add_node(name)
+        split, on_event = handler
+        fields = split(payload)
+        if fields is not None:
+            on_event(ts, *fields)
+
+    def apply(self, ev, ts, fields):
+        """Apply one already-parsed event, e.g. published in-process by sim.py."""
+        handler = self._handlers.get(ev)
+        if handler is not None:
+            handler[1](ts, *fields)
+
+    # Field splitters: rest-of-line -> handler fields, or None if malformed
+
+    def _split_initialized(self, rest):
+        # format: ts,initialized,NODx
+        return (rest,) if rest else None
+
+    def _split_connectivity(self, rest):
+        # format: ts,connectivity_update,<N*N row-major 0/1 matrix>
+        return (rest,)
+
+    def _split_tx(self, rest):
+        # format: ts,tx,src,HEXDATA
+        return (rest.partition(',')[0],)
+
+    def _split_forward(self, rest):
+        # format: ts,forward,src,dst,HEXDATA
+        src, sep, tail = rest.partition(',')
+        if not sep:
+            return None
+        return (src, tail.partition(',')[0])
+
+    def _split_state(self, rest):
+        # format: ts,state,dst,get_state,<uptime_ms>,<NAME1>,<TS1>,<LAT1>,<LON1>,...
+        dst, sep, state_str = rest.partition(',')
+        if not sep:
+            return None
+        return (dst, state_str)
+
+    # Event handlers
+
+    def _on_initialized(self, ts, name):
+        self.add_node(name)
+
+    def _on_connectivity(self, ts, matrix):
+        N = len(self.nodes)
+        matrix = matrix[:N*N]
+        if len(matrix) < N * N:
             return
-        # events
-        if ev == 'connectivity_update':
-            matrix = parts[2]
-            N = len(self.nodes)
-            for i, src in enumerate(self.nodes):
-                for j, dst in enumerate(self.nodes):
-                    if matrix[i*N + j] == '1':
-                        self.connectivity[dst].add(src)
-                    else:
-                        self.connectivity[dst].discard(src)
-        elif ev == 'tx':
-            # format: ts,tx,src,HEXDATA
-            rest = parts[2]
-            fields = rest.split(',', 1)
-            if len(fields) < 1:
-                return
-            src = fields[0]
-            # record tx event (no destination, just mark TX)
-            self.events[src].append((ts, 'TX', 'TX'))
-        elif ev == 'forward':
-            # format: ts,forward,src,dst,HEXDATA
-            fields = parts[2].split(',', 2)
-            if len(fields) < 2:
-                return
-            src, dst = fields[0], fields[1]
-            # record receive event only; source TX is already captured by 'tx'
-            self.events[dst].append((ts, 'RX', src))
-        elif ev == 'state':
-            # format: ts,state,dst,get_state,<uptime_ms>,<NAME1>,<TS1>,<LAT1>,<LON1>,...
-            rest = parts[2].split(',', 1)
-            if len(rest) < 2:
-                return
-            dst, state_str = rest
-            sp = state_str.split(',')
-            if not sp or sp[0] != 'get_state':
-                return
-            uptime = sp[1]
-            entries = sp[2:]
-            node_list = []
-            for i in range(len(entries) // 4):
-                name_i, ts_i, lat_i, lon_i = entries[4*i:4*i+4]
-                node_list.append((name_i, ts_i, lat_i, lon_i))
-            self.states[dst] = {'uptime': uptime, 'entries': node_list}
+        # steady topologies resend the same matrix; nothing to diff then
+        if (N, matrix) == self._prev_matrix:
+            return
+        self._prev_matrix = (N, matrix)
+        for j, mask in self._column_masks(matrix, N):
+            dst = self.nodes[j]
+            if mask ^ self.connectivity_mask[dst]:
+                self.connectivity_mask[dst] = mask
+                self._peers_cache.pop(dst, None)
+                self._dirty_nodes.add(dst)
+
+    def _on_tx(self, ts, src, *_):
+        src = self._names.get(src)
+        if src is None:
+            return
+        # record tx event (no destination, just mark TX)
+        self.events[src].append((ts, 'TX', 'TX'))
+        self._dirty_nodes.add(src)
+
+    def _on_forward(self, ts, src, dst, *_):
+        dst = self._names.get(dst)
+        if dst is None:
+            return
+        src = self._names.get(src, src)
+        # record receive event only; source TX is already captured by 'tx'
+        self.events[dst].append((ts, 'RX', src))
+        self._dirty_nodes.add(dst)
+
+    def _on_state(self, ts, dst, state_str):
+        # state_str: get_state,<uptime_ms>,<NAME1>,<TS1>,<LAT1>,<LON1>,...
+        dst = self._names.get(dst)
+        if dst is None:
+            return
+        sp = state_str.split(',')
+        if not sp or sp[0] != 'get_state':
+            return
+        uptime = sp[1]
+        # group the flat entry fields into (name, ts, lat, lon) tuples
+        it = iter(sp[2:])
+        node_list = list(zip(it, it, it, it))
+        self.states[dst] = {'uptime': uptime, 'entries': node_list}
+        self._dirty_nodes.add(dst)
+
+    def _column_masks(self, matrix, N):
+        """
+        Decode an N*N row-major matrix string into
+        (j, mask) pairs, mask having bit i set when row i reaches column j.
+        With numpy only columns that differ from the previous matrix are returned.
+        """
+        if numpy is None:
+            # as with numpy, anything but '1' counts as 0
+            bits = matrix.encode('ascii', 'replace').translate(_BIT_DIGITS)
+            # column j, reversed so that row i lands on bit i
+            return [(j, int(bits[j:N*N:N][::-1], 2)) for j in range(N)]
+        arr = numpy.frombuffer(matrix.encode('ascii', 'replace'),
+                               dtype=numpy.uint8).reshape(N, N) == ord('1')
+        prev = self._conn_arr
+        self._conn_arr = arr
+        if prev is None or prev.shape != arr.shape:
+            changed = numpy.arange(N)
+        else:
+            changed = numpy.flatnonzero((arr ^ prev).any(axis=0))
+        # one little-endian packed bit row per changed column
+        packed = numpy.packbits(arr[:, changed].T, axis=1, bitorder='little')
+        return [(int(j), int.from_bytes(row.tobytes(), 'little'))
+                for j, row in zip(changed, packed)]
+
+    def _peers_in(self, n):
+        peers = []
+        m = self.connectivity_mask.get(n, 0)
+        while m:
+            b = m & -m
+            peers.append(self.nodes[b.bit_length() - 1])
+            m ^= b
+        peers.sort()
+        return peers
+
+    def _peers_line(self, n):
+        line = self._peers_cache.get(n)
+        if line is None:
+            peers = self._peers_in(n)
+            peers_str = ", ".join(peers) if peers else "<none>"
+            line = self._peers_cache[n] = f"[cyan]Peers in: {escape(peers_str)}[/cyan]"
+        return line
+
+    def has_changes(self):
+        """True if generate_view would produce a different view than last time."""
+        return bool(self._dirty_nodes) or self.mode != self._panel_mode
 
     def generate_view(self):
         # choose view based on mode
-        if self.mode == 'state':
-            return self.generate_state_view()
-        panels = []
+        render = self._state_panel if self.mode == 'state' else self._events_panel
+        if self.mode != self._panel_mode:
+            self._panel_mode = self.mode
+            self._panel_cache.clear()
+            self._dirty_nodes.update(self.nodes)
+        # rebuild panels only for nodes that changed since the last view
+        for n in self._dirty_nodes:
+            self._panel_cache[n] = render(n)
+        self._dirty_nodes.clear()
         # always display nodes in sorted order
-        for n in sorted(self.nodes):
-            text = Text()
-            # connectivity
-            peers = sorted(self.connectivity.get(n, []))
-            peers_str = ", ".join(peers) if peers else "<none>"
-            text.append(f"Peers in: {peers_str}\n", style="cyan")
-            # last events
-            text.append("Last events:\n", style="magenta")
-            for ts, typ, other in list(self.events[n]):
-                arrow = "→" if typ == 'TX' else "←"
-                text.append(f" {ts:6.3f}s {arrow} {other}\n")
-            panels.append(Panel(text, title=n, expand=True))
-        return Columns(panels)
-
-    def generate_state_view(self):
-        panels = []
-        # always display nodes in sorted order
-        for n in sorted(self.nodes):
-            text = Text()
-            st = self.states.get(n)
-            if st:
-                text.append(f"Uptime: {st['uptime']} ms\n", style="green")
-                peers = sorted(self.connectivity.get(n, []))
-                peers_str = ", ".join(peers) if peers else "<none>"
-                text.append(f"Peers in: {peers_str}\n", style="cyan")
-                text.append("Entries:\n", style="magenta")
-                for name_i, ts_i, lat_i, lon_i in st['entries']:
-                    text.append(f" {name_i}: ts={ts_i}, lat={lat_i}, lon={lon_i}\n")
-            else:
-                text.append("No state yet\n", style="red")
-            panels.append(Panel(text, title=n, expand=True))
-        return Columns(panels)
+        return Columns([self._panel_cache[n] for n in self._sorted_nodes])
+
+    def _events_panel(self, n):
+        # compose the panel body as one markup string, parsed once
+        lines = [self._peers_line(n), "[magenta]Last events:[/magenta]"]
+        for ts, typ, other in self.events[n]:
+            arrow = "→" if typ == 'TX' else "←"
+            lines.append(f" {ts:6.3f}s {arrow} {escape(other)}")
+        lines.append("")
+        return Panel(Text.from_markup("\n".join(lines)), title=n, expand=True)
+
+    def _state_panel(self, n):
+        st = self.states.get(n)
+        if not st:
+            return Panel(Text("No state yet\n", style="red"), title=n, expand=True)
+        lines = [f"[green]Uptime: {escape(st['uptime'])} ms[/green]",
+                 self._peers_line(n),
+                 "[magenta]Entries:[/magenta]"]
+        for name_i, ts_i, lat_i, lon_i in st['entries']:
+            lines.append(escape(f" {name_i}: ts={ts_i}, lat={lat_i}, lon={lon_i}"))
+        lines.append("")
+        return Panel(Text.from_markup("\n".join(lines)), title=n, expand=True)
 
 def main():
     parser = argparse.ArgumentParser(description="Live monitor for sim_output.log")
@@ -162,6 +344,8 @@ def main():
                         help='Path to sim_output.log file, or - to read from stdin')
     parser.add_argument('--mode', choices=['events','state'], default='events',
                         help='Select display mode: events or state')
+    parser.add_argument('--history', type=int, default=DEFAULT_HISTORY,
+                        help='Number of recent events kept and shown per node')
     args = parser.parse_args()
 
     # Determine input source and escape support
@@ -176,32 +360,68 @@ def main():
 
     # Setup ESC listener to exit
     stop_event = threading.Event()
+    # set when lines are queued, input ends, or ESC is pressed
+    wake = threading.Event()
     if use_escape:
         fd = sys.stdin.fileno()
         orig_settings = termios.tcgetattr(fd)
         tty.setcbreak(fd)
+        # the listener blocks on stdin and this self-pipe; shutdown writes to it
+        esc_stop_r, esc_stop_w = os.pipe()
         def esc_listener():
-            while not stop_event.is_set():
-                dr, _, _ = select.select([sys.stdin], [], [], 0.1)
-                if dr and sys.stdin.read(1) == '\x1b':
+            while True:
+                dr, _, _ = select.select([fd, esc_stop_r], [], [])
+                if esc_stop_r in dr:
+                    return
+                ch = os.read(fd, 1)
+                if not ch:
+                    return
+                if ch == b'\x1b':
                     stop_event.set()
+                    wake.set()
+                    return
         threading.Thread(target=esc_listener, daemon=True).start()
 
-    mon = Monitor()
+    # Ingest thread only appends raw lines and the render loop only pops them,
+    # so deque's atomic append/popleft need no extra locking
+    raw = deque()
+    ingest_done = threading.Event()
+    def ingest():
+        for line in lines:
+            if stop_event.is_set():
+                break
+            if line:
+                raw.append(line)
+                wake.set()
+        ingest_done.set()
+        wake.set()
+    threading.Thread(target=ingest, daemon=True).start()
+
+    mon = Monitor(history=args.history)
     mon.mode = args.mode
+    refresh_interval = 1.0 / REFRESH_PER_SECOND
     try:
-        with Live(mon.generate_view(), refresh_per_second=4, screen=True) as live:
-            for line in lines:
-                if use_escape and stop_event.is_set():
+        with Live(mon.generate_view(), refresh_per_second=REFRESH_PER_SECOND, screen=True) as live:
+            while not stop_event.is_set():
+                # sleep until input arrives (no periodic wakeups while idle),
+                # then parse everything queued and redraw once
+                wake.wait(timeout=1.0)
+                wake.clear()
+                finished = ingest_done.is_set()
+                while raw:
+                    mon.parse_line(raw.popleft())
+                # lines that changed no node (unknown events, repeated matrices) skip the redraw
+                if mon.has_changes():
+                    live.update(mon.generate_view())
+                if finished:
                     break
-                if not line:
-                    continue
-                mon.parse_line(line)
-                live.update(mon.generate_view())
+                # redraw at most once per refresh interval
+                stop_event.wait(refresh_interval)
     except KeyboardInterrupt:
         pass
     finally:
         if use_escape:
+            os.write(esc_stop_w, b'x')
             termios.tcsetattr(fd, termios.TCSADRAIN, orig_settings)
 
 if __name__ == '__main__':
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+render_log.py: Convert the nodes.bin file written by sim.py --raw-logs to text.
+
+nodes.bin holds every node's output as frames: a little-endian header
+(node index u16, stream u8, ns since simulation start u64, payload length u32)
+followed by the payload. Stream 0 is stdout, 1 is stderr, and 255 declares the
+node's name for its index.
+
+By default all lines are printed as CSV: ts,node,stream,line. With --outdir the
+usual <NODE>.stdout.log / <NODE>.stderr.log text logs (ts,line) are recreated
+there instead.
+"""
+import os
+import sys
+import struct
+import argparse
+
+_FRAME = struct.Struct('<HBQI')
+_STREAM_STDOUT, _STREAM_STDERR, _STREAM_NAME = 0, 1, 255
+_STREAMS = {_STREAM_STDOUT: 'stdout', _STREAM_STDERR: 'stderr'}
+
+def frames(f):
+    """Yield (node index, stream, ns, payload) for each complete frame."""
+    while True:
+        head = f.read(_FRAME.size)
+        if len(head) < _FRAME.size:
+            return
+        idx, stream, ns, size = _FRAME.unpack(head)
+        payload = f.read(size)
+        if len(payload) < size:
+            return
+        yield idx, stream, ns, payload
+
+def main():
+    parser = argparse.ArgumentParser(description="Render sim.py --raw-logs nodes.bin as text")
+    parser.add_argument('file', help='nodes.bin written by sim.py --raw-logs')
+    parser.add_argument('--outdir', default=None,
+                        help='Recreate per-node .stdout.log/.stderr.log files here instead of printing CSV')
+    args = parser.parse_args()
+    names = {}
+    logs = {}
+    out = sys.stdout.buffer
+    with open(args.file, 'rb') as f:
+        for idx, stream, ns, payload in frames(f):
+            if stream == _STREAM_NAME:
+                names[idx] = payload.decode()
+                continue
+            name = names.get(idx, str(idx))
+            kind = _STREAMS.get(stream, str(stream))
+            if args.outdir is None:
+                out.write(b"%.3f,%s,%s,%s\n" % (ns / 1e9, name.encode(), kind.encode(), payload))
+                continue
+            log = logs.get((name, kind))
+            if log is None:
+                log = logs[(name, kind)] = open(os.path.join(args.outdir, f"{name}.{kind}.log"), 'wb')
+            log.write(b"%.3f,%s\n" % (ns / 1e9, payload))
+    for log in logs.values():
+        log.close()
+    out.flush()
+
+if __name__ == '__main__':
+    main()
@@ -29,23 +29,263 @@ Usage:
 import argparse
 import threading
 import subprocess
+import traceback
+import struct
+import functools
 import time
 import os
 import sys
 import queue
+import heapq
+import itertools
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeout
 import random
 import select
+import selectors
+import fcntl
 import termios
 import tty
+from bisect import insort
 from collections import deque
+from operator import itemgetter
 try:
+    from rich.console import Console
     from rich.live import Live
     from rich.panel import Panel
     from rich.columns import Columns
     from rich.text import Text
+    from rich.markup import escape
 except ImportError:
     print("Error: please install rich (pip install rich)", file=sys.stderr)
     sys.exit(1)
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Seconds between background get_state polls of every node
+STATE_POLL_INTERVAL = 0.25
+# Max nodes forked at once when several spawn offsets are due together
+SPAWN_WORKERS = 16
+# Max bytes per os.read() of a child's output pipe
+READ_SIZE = 65536
+# Requested capacity of each child's stdout pipe (Linux; default is 64 KiB, and 1 MiB
+# is the stock unprivileged limit in /proc/sys/fs/pipe-max-size)
+PIPE_SIZE = 1 << 20
+_F_SETPIPE_SZ = getattr(fcntl, 'F_SETPIPE_SZ', 1031 if sys.platform.startswith('linux') else None)
+# Child stdout lines the orchestrator acts on; everything else is only logged
+_TX_PREFIX = b"transmit_packet,"
+_STATE_PREFIX = b"get_state"
+_ACTION_PREFIXES = (_TX_PREFIX, _STATE_PREFIX)
+# Logs are buffered in memory and written out by the LogFlusher thread this often
+LOG_FLUSH_INTERVAL = 0.05
+LOG_BUFFER_SIZE = 65536
+# --raw-logs frame header, as read by python_sim/render_log.py:
+# node index, stream, ns since start, payload length
+_FRAME = struct.Struct('<HBQI')
+_STREAM_STDOUT, _STREAM_STDERR, _STREAM_NAME = 0, 1, 255
+
+# byte -> 1 for b'1', 0 otherwise; decodes a matrix string without numpy
+_MATRIX_BITS = bytes(int(c == ord('1')) for c in range(256))
+# byte -> b'1' for b'1', b'0' otherwise; lets int(..., 2) read any matrix
+_BIT_DIGITS = bytes(ord('1') if c == ord('1') else ord('0') for c in range(256))
+
+def parse_adjacency(matrix_str, n):
+    """
+    Decode a flat row-major 0/1 string of length n*n into an n x n adjacency
+    (uint8 array with numpy, else a list of n bytes rows); adj[src][dst] is 1
+    when src reaches dst. The diagonal is always cleared: a node never
+    receives its own packets.
+    """
+    raw = matrix_str.encode('ascii', 'replace')
+    if numpy is not None:
+        adj = (numpy.frombuffer(raw, dtype=numpy.uint8).reshape(n, n) == ord('1')).astype(numpy.uint8)
+        numpy.fill_diagonal(adj, 0)
+        return adj
+    bits = bytearray(raw.translate(_MATRIX_BITS))
+    bits[::n + 1] = bytes(n)
+    return [bytes(bits[i*n:(i+1)*n]) for i in range(n)]
+
+def _nonzero(row):
+    """Indices of the set cells of one adjacency row."""
+    if numpy is not None:
+        return numpy.flatnonzero(row).tolist()
+    # bytes.find skips runs of zeros in C: one Python step per set cell
+    out = []
+    j = row.find(1)
+    while j >= 0:
+        out.append(j)
+        j = row.find(1, j + 1)
+    return out
+
+def _pipe_budget():
+    """Bytes of pipe buffer we may add: half the per-user soft limit, so
+    the user's other pipes never get shrunk to one page; None if unlimited."""
+    try:
+        with open('/proc/sys/fs/pipe-user-pages-soft') as f:
+            pages = int(f.read())
+    except (OSError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') // 2 if pages else None
+
+# cleared once the kernel refuses to grow pipes for this user
+_pipe_growth = _F_SETPIPE_SZ is not None
+_pipe_bytes_left = _pipe_budget() if _pipe_growth else None
+
+def _grow_pipe(fd, size=PIPE_SIZE):
+    """Enlarge a pipe's kernel buffer so bursts do not back-pressure the child."""
+    global _pipe_growth, _pipe_bytes_left
+    if not _pipe_growth:
+        return
+    if _pipe_bytes_left is not None:
+        if _pipe_bytes_left < size:
+            return
+        _pipe_bytes_left -= size
+    try:
+        fcntl.fcntl(fd, _F_SETPIPE_SZ, size)
+    except PermissionError:
+        # over pipe-max-size or the per-user pipe budget; further attempts
+        # would only eat into what is left for everyone's pipes
+        _pipe_growth = False
+        print(f"Warning: cannot enlarge node pipes to {size} bytes; keeping the default size",
+              file=sys.stderr)
+    except OSError:
+        pass  # not a pipe; keep the default
+
+@functools.lru_cache(maxsize=1024)
+def _rx_command(hexdata):
+    """Encoded network_receive_packet line for hexdata; replays and
+    repeated payloads reuse the same bytes object."""
+    return b"network_receive_packet," + hexdata.encode() + b"\n"
+
+class LogBuffer:
+    """
+    In-memory record buffer in front of a log file. append() never does
+    I/O; flush() writes out what is pending.
+    """
+    def __init__(self, f):
+        self.f = f
+        self._pending = []
+        self._lock = threading.Lock()
+        # serializes flushers (LogFlusher vs. shutdown) so records stay in order
+        self._write_lock = threading.Lock()
+
+    def append(self, record):
+        with self._lock:
+            self._pending.append(record)
+
+    def flush(self, f=None):
+        """Write out the pending records to f (default: self.f) and flush it."""
+        f = self.f if f is None else f
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            try:
+                if pending:
+                    f.write(pending[0][:0].join(pending))
+                f.flush()
+            except ValueError:
+                pass  # closed
+
+class EventBus:
+    """
+    Publishes simulation events as CSV lines (ts,kind,fields...) to
+    stdout via flush(), and as (kind, ts, fields) to an attached monitor.
+    """
+    def __init__(self):
+        self.q = None
+        # publishers run on the I/O and main threads; records stay whole lines
+        self._out = LogBuffer(None)
+        self._append = self._out.append
+
+    def attach_monitor(self):
+        self.q = queue.SimpleQueue()
+        return self.q
+
+    def publish(self, kind, ts, *fields):
+        self._append(f"{ts:.3f},{kind}," + ",".join(fields) + "\n")
+        q = self.q
+        if q is not None:
+            q.put((kind, ts, fields))
+
+    def publish_many(self, kind, ts, rows):
+        """Publish one event per fields tuple in rows, all stamped ts, in one write."""
+        prefix = f"{ts:.3f},{kind},"
+        self._append("".join([prefix + ",".join(fields) + "\n" for fields in rows]))
+        q = self.q
+        if q is not None:
+            put = q.put
+            for fields in rows:
+                put((kind, ts, fields))
+
+    def flush(self):
+        # sys.stdout is looked up here: main swaps it for the Tee and back
+        self._out.flush(sys.stdout)
+
+class EventQueue:
+    """
+    Pending input events, handed to dispatch(dest, [(ts, data), ...]) on
+    the IoMux thread as they come due; same-node runs arrive together.
+    """
+    def __init__(self, events, io, start_time, dispatch):
+        self._heap = [(ts, i, dest, data) for i, (ts, dest, data) in enumerate(events)]
+        heapq.heapify(self._heap)
+        self._seq = itertools.count(len(self._heap))
+        self._lock = threading.Lock()
+        self._closed = False
+        self.io = io
+        self.start_time = start_time
+        self.dispatch = dispatch
+        # ts the armed timer fires at, and its token; touched on the mux thread only
+        self._armed_ts = None
+        self._token = None
+
+    def start(self):
+        self.io.call_soon(self._arm)
+
+    def push(self, ts, dest, data):
+        with self._lock:
+            heapq.heappush(self._heap, (ts, next(self._seq), dest, data))
+        self.io.call_soon(self._arm)
+
+    def close(self):
+        """Stop dispatching; events still queued are dropped."""
+        self._closed = True
+
+    def _arm(self):
+        with self._lock:
+            if not self._heap:
+                return
+            ts = self._heap[0][0]
+        if self._armed_ts is not None and self._armed_ts <= ts:
+            return
+        self._armed_ts = ts
+        token = self._token = object()
+        self.io.call_at(self.start_time + ts, lambda: self._fire(token))
+
+    def _fire(self, token):
+        if token is not self._token or self._closed:
+            return  # superseded by an earlier re-arm
+        self._armed_ts = self._token = None
+        now = time.perf_counter() - self.start_time
+        try:
+            while not self._closed:
+                with self._lock:
+                    if not self._heap or self._heap[0][0] > now:
+                        break
+                    ts, _, dest, data = heapq.heappop(self._heap)
+                    batch = [(ts, data)]
+                    # Coalesce following commands for the same node that are
+                    # already due into one stdin write
+                    if dest != '-1':
+                        while self._heap and self._heap[0][2] == dest and self._heap[0][0] <= now:
+                            ts, _, _, data = heapq.heappop(self._heap)
+                            batch.append((ts, data))
+                self.dispatch(dest, batch)
+        finally:
+            # re-arm even if dispatch raised, so one bad event does not
+            # stop the rest of the input
+            self._arm()
 
 # Tee stdout to both console and sim_output.log file
 class Tee:
@@ -58,113 +298,404 @@ class Tee:
         for w in self.writers:
             w.flush()
 
+class IoMux:
+    """
+    Runs all child-process pipe I/O and timers on a single thread.
+    Fd callbacks run as cb(fd) and return True once the fd should be dropped.
+    """
+    def __init__(self):
+        self.sel = selectors.DefaultSelector()
+        self._lock = threading.Lock()
+        # (fd, events, cb) registrations requested from other threads
+        self._pending = []
+        # heap of (perf_counter deadline, seq, fn)
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._wake_r, self._wake_w = os.pipe()
+        os.set_blocking(self._wake_r, False)
+        os.set_blocking(self._wake_w, False)
+        self.sel.register(self._wake_r, selectors.EVENT_READ, None)
+        threading.Thread(target=self.run, daemon=True).start()
+
+    def _wake(self):
+        try:
+            os.write(self._wake_w, b'x')
+        except BlockingIOError:
+            pass  # a wakeup is already queued
+
+    def _request(self, fd, events, cb):
+        with self._lock:
+            self._pending.append((fd, events, cb))
+        self._wake()
+
+    def call_at(self, when, fn):
+        """Run fn() on the mux thread once time.perf_counter() reaches when."""
+        with self._lock:
+            heapq.heappush(self._timers, (when, next(self._timer_seq), fn))
+        self._wake()
+
+    def call_soon(self, fn):
+        self.call_at(0, fn)
+
+    def add_reader(self, fd, on_lines):
+        """
+        Call on_lines(list of bytes) with the complete lines of each read
+        from fd, on the mux thread; at most PIPE_SIZE bytes per wakeup.
+        """
+        os.set_blocking(fd, False)
+        partial = [b'']
+        def on_readable(fd):
+            total = 0
+            while total < PIPE_SIZE:
+                try:
+                    chunk = os.read(fd, READ_SIZE)
+                except BlockingIOError:
+                    return False
+                except OSError:
+                    chunk = b''
+                if not chunk:
+                    if partial[0]:
+                        on_lines([partial[0]])
+                    return True
+                # hand over each read as it comes, keeping the working set
+                # at READ_SIZE instead of joining the whole backlog
+                lines = (partial[0] + chunk).split(b'\n')
+                partial[0] = lines.pop()
+                if lines:
+                    on_lines(lines)
+                if len(chunk) < READ_SIZE:
+                    return False
+                total += len(chunk)
+            return False
+        self._request(fd, selectors.EVENT_READ, on_readable)
+
+    def want_write(self, fd, on_writable):
+        """Call on_writable(fd) whenever fd can take more data."""
+        self._request(fd, selectors.EVENT_WRITE, on_writable)
+
+    def _run_timers(self):
+        """Run due timers; return seconds until the next one, or None."""
+        while True:
+            now = time.perf_counter()
+            with self._lock:
+                if not self._timers:
+                    return None
+                if self._timers[0][0] > now:
+                    return self._timers[0][0] - now
+                _, _, fn = heapq.heappop(self._timers)
+            try:
+                fn()
+            except Exception:
+                traceback.print_exc()
+
+    def run(self):
+        while True:
+            timeout = self._run_timers()
+            for key, _ in self.sel.select(timeout):
+                if key.data is None:
+                    try:
+                        os.read(self._wake_r, READ_SIZE)
+                    except BlockingIOError:
+                        pass
+                    with self._lock:
+                        pending, self._pending = self._pending, []
+                    for fd, events, cb in pending:
+                        try:
+                            self.sel.register(fd, events, cb)
+                        except KeyError:
+                            pass  # already watched
+                    continue
+                try:
+                    done = key.data(key.fd)
+                except Exception:
+                    # every node's I/O runs here; one bad line must not stop it
+                    traceback.print_exc()
+                    done = False
+                if done:
+                    self.sel.unregister(key.fd)
+
+class LogFlusher:
+    """
+    Flushes the registered logs from its own thread every LOG_FLUSH_INTERVAL.
+    """
+    def __init__(self, interval=LOG_FLUSH_INTERVAL):
+        self._flushers = []
+        self._stop = threading.Event()
+        def run():
+            while not self._stop.wait(interval):
+                self.flush()
+        threading.Thread(target=run, daemon=True).start()
+
+    def add(self, flush):
+        self._flushers.append(flush)
+
+    def flush(self):
+        for flush in tuple(self._flushers):
+            flush()
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+class RawNodeLog:
+    """
+    Single binary appender for every node's output (sim.py --raw-logs),
+    one _FRAME per line; render_log.py turns it back into text.
+    """
+    def __init__(self, path, start_time):
+        self._buf = LogBuffer(open(path, "wb", buffering=LOG_BUFFER_SIZE))
+        self._append = self._buf.append
+        self._start_ns = int(start_time * 1e9)
+        self._lock = threading.Lock()
+        self._names = []
+
+    def add_node(self, name):
+        with self._lock:
+            idx = len(self._names)
+            self._names.append(name)
+            data = name.encode()
+            self._append(_FRAME.pack(idx, _STREAM_NAME, 0, len(data)) + data)
+        return idx
+
+    def write(self, idx, stream, lines):
+        """Append one frame per line, all stamped with the same read time."""
+        ns = time.perf_counter_ns() - self._start_ns
+        pack = _FRAME.pack
+        self._append(b"".join([pack(idx, stream, ns, len(raw)) + raw for raw in lines]))
+
+    def flush(self):
+        self._buf.flush()
+
 class NodeProc:
     def __init__(self, name, exe_path, outdir, start_time, dispatcher):
         self.name = name
         self.start_time = start_time
         self.dispatcher = dispatcher
-        # Open log files
-        self.stdout_log = open(os.path.join(outdir, f"{name}.stdout.log"), "w", buffering=1)
-        self.stderr_log = open(os.path.join(outdir, f"{name}.stderr.log"), "w", buffering=1)
-        # Launch process
+        # bound once; the stdout handler runs for every line of every node
+        self._publish = dispatcher.bus.publish
+        self._deliver = dispatcher.deliver_packet
+        # index into the dispatcher's per-node tables
+        self.name_id = dispatcher.name_to_idx[name]
+        raw_log = dispatcher.raw_log
+        if raw_log is None:
+            # Open log files; binary, behind LogBuffers written out by the LogFlusher
+            self.stdout_log = LogBuffer(open(os.path.join(outdir, f"{name}.stdout.log"), "wb", buffering=LOG_BUFFER_SIZE))
+            self.stderr_log = LogBuffer(open(os.path.join(outdir, f"{name}.stderr.log"), "wb", buffering=LOG_BUFFER_SIZE))
+            self._log_out = functools.partial(self._log_text, self.stdout_log)
+            self._log_err = functools.partial(self._log_text, self.stderr_log)
+        else:
+            # --raw-logs: frames in the dispatcher's shared appender
+            self.stdout_log = self.stderr_log = None
+            idx = raw_log.add_node(name)
+            self._log_out = functools.partial(raw_log.write, idx, _STREAM_STDOUT)
+            self._log_err = functools.partial(raw_log.write, idx, _STREAM_STDERR)
+        # Launch process; its pipes are driven by the dispatcher's IoMux
         self.proc = subprocess.Popen(
             [exe_path], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
-            text=True, bufsize=1
+            bufsize=0
         )
+        self._stdin_fd = self.proc.stdin.fileno()
+        os.set_blocking(self._stdin_fd, False)
+        # only stdout carries bursts; stdin backlog goes to _stdin_buf
+        _grow_pipe(self.proc.stdout.fileno())
         self._stdin_lock = threading.Lock()
-        # Queue for capturing non-transmit stdout responses
-        self._resp_queue = queue.Queue()
-        # Start reader threads
-        threading.Thread(target=self._read_stdout, daemon=True).start()
-        threading.Thread(target=self._read_stderr, daemon=True).start()
+        # bytes the child's stdin pipe could not take yet; flushed by the mux
+        self._stdin_buf = bytearray()
+        self._stdin_closed = False
+        # Outstanding get_state requests in send order: a Future for get_state(),
+        # None for a request_state() poll. The node answers in order, so each
+        # reply settles the oldest entry and a timed-out waiter is just skipped.
+        self._state_reqs = deque()
+        # held by requesters only, to keep queue order equal to pipe order
+        self._req_lock = threading.Lock()
+        # Hand the output pipes to the shared I/O thread
+        dispatcher.io.add_reader(self.proc.stdout.fileno(), self._on_stdout_lines)
+        dispatcher.io.add_reader(self.proc.stderr.fileno(), self._log_err)
+        if raw_log is None:
+            dispatcher.log_flusher.add(self.flush_logs)
 
     def _timestamp(self):
-        return time.time() - self.start_time
-
-    def _read_stdout(self):
-        for line in self.proc.stdout:
-            line = line.rstrip("\n")
-            ts = self._timestamp()
-            # Log with timestamp
-            self.stdout_log.write(f"{ts:.3f},{line}\n")
-            # Intercept transmit_packet for forwarding
-            if line.startswith("transmit_packet"):  # format: transmit_packet,LEN,HEXDATA
-                try:
-                    parts = line.split(',', 2)
-                    hexdata = parts[2]
-                except Exception:
-                    continue
-                # Log transmit event
-                ts = self._timestamp()
-                print(f"{ts:.3f},tx,{self.name},{hexdata}", flush=True)
-                # Dispatch to other nodes
-                self.dispatcher.deliver_packet(self.name, hexdata)
-                # do not queue transmit_packet lines
-                continue
-            # Queue other stdout responses (e.g., node_update, get_state)
-            self._resp_queue.put(line)
+        return time.perf_counter() - self.start_time
+
+    def _log_text(self, log, lines):
+        # Lines of one read share its timestamp, so a chunk is a single join
+        prefix = b"%.3f," % self._timestamp()
+        log.append(prefix + (b"\n" + prefix).join(lines) + b"\n")
+
+    def _on_stdout_lines(self, lines):
+        # Log with timestamp
+        self._log_out(lines)
+        # Filter on the raw bytes; only lines we act on get decoded
+        for raw in lines:
+            if raw.startswith(_ACTION_PREFIXES):
+                self._on_action(raw)
+
+    def _on_action(self, raw):
+        if raw.startswith(_TX_PREFIX):  # format: transmit_packet,LEN,HEXDATA
+            # skip the LEN field with one scan rather than building a list
+            comma = raw.find(b',', len(_TX_PREFIX))
+            if comma < 0:
+                return
+            hexdata = raw[comma + 1:].decode('ascii', 'replace')
+            # Log transmit event
+            self._publish('tx', self._timestamp(), self.name, hexdata)
+            # Dispatch to other nodes
+            self._deliver(self.name_id, hexdata)
+            return
+        if raw.startswith(_STATE_PREFIX):
+            line = raw.decode('utf-8', 'replace')
+            # sole consumer: deque.popleft is atomic, so no lock on this side
+            try:
+                fut = self._state_reqs.popleft()
+            except IndexError:
+                return  # unsolicited
+            if fut is None:
+                # answer to a request_state() poll: emit for the live monitor
+                self._publish('state', self._timestamp(), self.name, line)
+            elif not fut.done():
+                fut.set_result(line)
 
-    def _read_stderr(self):
-        for line in self.proc.stderr:
-            line = line.rstrip("\n")
-            ts = self._timestamp()
-            self.stderr_log.write(f"{ts:.3f},{line}\n")
+    def flush_logs(self):
+        if self.stdout_log is None:
+            self.dispatcher.raw_log.flush()
+            return
+        self.stdout_log.flush()
+        self.stderr_log.flush()
 
     def send_command(self, cmd_str):
         """
         Send a command line (without newline) to the node.
         """
+        self.send_raw(cmd_str.encode() + b"\n")
+
+    def send_commands(self, cmds):
+        """
+        Send several command lines to the node with a single write.
+        """
+        if cmds:
+            self.send_raw(("\n".join(cmds) + "\n").encode())
+
+    def send_raw(self, data):
+        """
+        Write newline-terminated command bytes to the child's stdin without
+        blocking. Returns False if stdin is closed and the bytes were dropped.
+        """
+        with self._stdin_lock:
+            return self._write_stdin(data)
+
+    def _write_stdin(self, data):
+        # Caller holds self._stdin_lock
+        if self._stdin_closed:
+            return False
+        if self._stdin_buf:
+            # keep ordering behind the bytes already waiting
+            self._stdin_buf.extend(data)
+            return True
+        try:
+            n = os.write(self._stdin_fd, data)
+        except BlockingIOError:
+            n = 0
+        except OSError:
+            # child exited and closed its stdin
+            self._stdin_closed = True
+            return False
+        if n < len(data):
+            self._stdin_buf.extend(data[n:])
+            self.dispatcher.io.want_write(self._stdin_fd, self._flush_stdin)
+        return True
+
+    def _flush_stdin(self, fd):
         with self._stdin_lock:
-            if self.proc.stdin:
-                self.proc.stdin.write(cmd_str + "\n")
-                self.proc.stdin.flush()
+            try:
+                n = os.write(fd, self._stdin_buf)
+            except BlockingIOError:
+                return False
+            except OSError:
+                self._stdin_closed = True
+                self._stdin_buf.clear()
+                return True
+            del self._stdin_buf[:n]
+            return not self._stdin_buf
+
+    def request_state(self):
+        """
+        Send a get_state command without waiting; the response is logged
+        as a state event by the stdout reader.
+        """
+        self._send_state_request(None)
+
+    def _send_state_request(self, entry):
+        """
+        Queue entry for the next get_state reply and send the command;
+        returns False, queuing nothing, if the child's stdin is closed.
+        """
+        # queue and send under one lock so the FIFO matches the pipe order
+        with self._req_lock, self._stdin_lock:
+            if self._stdin_closed:
+                return False
+            self._state_reqs.append(entry)
+            if self._write_stdin(b"get_state\n"):
+                return True
+            # no reply can come; the reader only pops older entries, so
+            # ours is still the newest
+            self._state_reqs.pop()
+            return False
+
+    def is_alive(self):
+        return self.proc.poll() is None
 
     def terminate(self):
         try:
             self.proc.terminate()
         except Exception:
             pass
+        self.flush_logs()
     def get_state(self, timeout=1.0):
         """
         Send a get_state command and wait for its response line.
-        Returns the raw response (without timestamp) or None on timeout.
+        Returns the raw response (without timestamp), or None on timeout or
+        if the node has exited.
         """
-        # send the get_state command
-        with self._stdin_lock:
-            if self.proc.stdin:
-                self.proc.stdin.write("get_state\n")
-                self.proc.stdin.flush()
-        # clear any stale responses
+        fut = Future()
+        if not self.is_alive() or not self._send_state_request(fut):
+            return None  # the node has exited; nothing will answer
         try:
-            while True:
-                self._resp_queue.get_nowait()
-        except queue.Empty:
-            pass
-        # wait for get_state response
-        deadline = time.time() + timeout
-        while True:
-            remaining = deadline - time.time()
-            if remaining <= 0:
-                break
-            try:
-                line = self._resp_queue.get(timeout=remaining)
-            except queue.Empty:
-                break
-            if line.startswith("get_state"):
-                return line
-        return None
+            return fut.result(timeout=timeout)
+        except FutureTimeout:
+            # left queued: its late reply is consumed and dropped, not
+            # mistaken for the answer to a later request
+            return None
 
 class Dispatcher:
-    def __init__(self, node_names):
-        # connectivity[src][dst] = bool
+    def __init__(self, node_names, bus, raw_log=None):
+        self.bus = bus
+        # shared RawNodeLog for --raw-logs, else None for per-node text logs
+        self.raw_log = raw_log
         self.node_names = list(node_names)
         self.N = len(self.node_names)
-        self.conn = {src: {dst: False for dst in self.node_names} for src in self.node_names}
+        self.name_to_idx = {name: i for i, name in enumerate(self.node_names)}
+        # adj[src_idx][dst_idx] == 1 when src reaches dst
+        self.adj = parse_adjacency('0' * (self.N * self.N), self.N)
         self._lock = threading.Lock()
         self.nodes = {}
+        # one thread multiplexes every node's pipes
+        self.io = IoMux()
+        self.log_flusher = LogFlusher()
+        self.log_flusher.add(bus.flush)
+        if raw_log is not None:
+            self.log_flusher.add(raw_log.flush)
+        # NodeProc per node index, None until spawned
+        self.nodes_by_id = [None] * self.N
+        # src index -> tuple of (dst name, NodeProc). Rebuilt under _lock and
+        # published as one immutable tuple, so deliver_packet reads it lock-free
+        self.neighbors = ((),) * self.N
+        self._poll_stop = threading.Event()
 
     def register(self, node_proc):
-        self.nodes[node_proc.name] = node_proc
+        with self._lock:
+            self.nodes[node_proc.name] = node_proc
+            self.nodes_by_id[node_proc.name_id] = node_proc
+            self._rebuild_neighbors()
 
     def update_connectivity(self, matrix_str, ts):
         """
@@ -173,170 +704,297 @@ class Dispatcher:
         if len(matrix_str) != self.N * self.N:
             print(f"ERROR: connectivity string length {len(matrix_str)} != {self.N}^2", file=sys.stderr)
             return
-        with self._lock:
-            for i, src in enumerate(self.node_names):
-                for j, dst in enumerate(self.node_names):
-                    self.conn[src][dst] = (matrix_str[i*self.N + j] == '1')
+        self.set_matrix(matrix_str)
         # Log to simulator-wide stdout
-        print(f"{ts:.3f},connectivity_update,{matrix_str}")
+        self.bus.publish('connectivity_update', ts, matrix_str)
 
-    def deliver_packet(self, src, hexdata):
+    def set_matrix(self, matrix_str):
         """
-        Forward a transmit_packet from src to all reachable dst nodes.
+        Apply a flat N*N matrix string without logging it.
         """
+        adj = parse_adjacency(matrix_str, self.N)
         with self._lock:
-            for dst, allowed in self.conn.get(src, {}).items():
-                if allowed and dst != src:
-                    # send network_receive_packet
-                    cmd = f"network_receive_packet,{hexdata}"
-                    node = self.nodes.get(dst)
-                    if node:
-                        node.send_command(cmd)
-                        # Log packet forwarding with sim timestamp
-                        ts = node._timestamp()
-                        print(f"{ts:.3f},forward,{src},{dst},{hexdata}", flush=True)
-                        # Upon receipt, fetch and emit the node's state for live monitoring
-                        try:
-                            state_resp = node.get_state(timeout=0.2)
-                            if state_resp:
-                                print(f"{ts:.3f},state,{dst},{state_resp}", flush=True)
-                        except Exception:
-                            pass
+            self.adj = adj
+            self._rebuild_neighbors()
+
+    def _rebuild_neighbors(self):
+        # Caller holds self._lock
+        names, by_id = self.node_names, self.nodes_by_id
+        self.neighbors = tuple(
+            tuple((names[j], by_id[j]) for j in _nonzero(self.adj[i]) if by_id[j] is not None)
+            for i in range(self.N)
+        )
+
+    def deliver_packet(self, src_id, hexdata):
+        """
+        Forward a transmit_packet from node index src_id to all reachable dst nodes.
+        """
+        # one load of the current snapshot; a concurrent update swaps in a new one
+        targets = self.neighbors[src_id]
+        if not targets:
+            return
+        src = self.node_names[src_id]
+        # encode once for the whole fanout, and once per distinct payload
+        data = _rx_command(hexdata)
+        for _, node in targets:
+            node.send_raw(data)
+        # Log packet forwarding with one sim timestamp for the whole fanout
+        ts = targets[0][1]._timestamp()
+        self.bus.publish_many('forward', ts, [(src, dst, hexdata) for dst, _ in targets])
+
+    def start_state_poller(self, interval=STATE_POLL_INTERVAL):
+        """
+        Periodically ask every registered node for its state, without waiting
+        for the answers, so the live monitor sees state events. Runs as a
+        self-rescheduling timer on the mux thread.
+        """
+        def poll():
+            if self._poll_stop.is_set():
+                return
+            try:
+                for node in list(self.nodes.values()):
+                    if node.is_alive():
+                        node.request_state()
+            finally:
+                self.io.call_at(time.perf_counter() + interval, poll)
+        self.io.call_at(time.perf_counter() + interval, poll)
+
+    def stop_state_poller(self):
+        self._poll_stop.set()
 
 def load_events(input_file):
     events = []
+    append = events.append
+    in_order = True
+    last_ts = float('-inf')
     with open(input_file) as f:
         for lineno, raw in enumerate(f, start=1):
             # Strip out full-line or inline comments (anything after '#')
-            line = raw.split('#', 1)[0].strip()
+            line = raw.partition('#')[0].strip()
             if not line:
                 continue
-            parts = line.split(',', 2)
-            if len(parts) < 3:
+            ts_s, _, rest = line.partition(',')
+            dest, sep, data = rest.partition(',')
+            if not sep:
                 print(f"Skipping malformed line {lineno}: {line}", file=sys.stderr)
                 continue
             try:
-                ts = float(parts[0])
+                ts = float(ts_s)
             except ValueError:
-                print(f"Invalid timestamp on line {lineno}: {parts[0]}", file=sys.stderr)
+                print(f"Invalid timestamp on line {lineno}: {ts_s}", file=sys.stderr)
                 continue
-            dest = parts[1]
-            data = parts[2]
-            events.append((ts, dest, data))
-    # assume input sorted; otherwise sort by ts
-    events.sort(key=lambda x: x[0])
+            if ts < last_ts:
+                in_order = False
+            last_ts = ts
+            append((ts, dest, data))
+    # input is normally sorted already; only pay for the (stable) sort when not
+    if not in_order:
+        events.sort(key=itemgetter(0))
     return events
 
 # Monitor live display code merged from monitor.py
-def tail_f(path):
-    with open(path, 'r') as f:
-        f.seek(0, os.SEEK_END)
-        while True:
-            line = f.readline()
-            if not line:
-                time.sleep(0.1)
-                continue
-            yield line.rstrip("\n")
-
+REFRESH_PER_SECOND = 4
+DEFAULT_HISTORY = 5
 class Monitor:
-    def __init__(self):
+    def __init__(self, history=DEFAULT_HISTORY):
         self.nodes = []
+        self._sorted_nodes = []
+        self._names = {}
+        self.history = history
         self.events = {}
-        self.connectivity = {}
+        self.connectivity_mask = {}
+        self._peers_cache = {}
+        self._conn_arr = None
+        self._prev_matrix = None
         self.states = {}
         self.mode = 'events'
+        self._panel_cache = {}
+        self._panel_mode = None
+        self._dirty_nodes = set()
+        self._handlers = {
+            'initialized': (self._split_initialized, self._on_initialized),
+            'connectivity_update': (self._split_connectivity, self._on_connectivity),
+            'tx': (self._split_tx, self._on_tx),
+            'forward': (self._split_forward, self._on_forward),
+            'state': (self._split_state, self._on_state),
+        }
 
     def add_node(self, name):
-        if name in self.nodes:
+        if name in self._names:
             return
+        name = sys.intern(name)
+        self._names[name] = name
         self.nodes.append(name)
-        self.events[name] = deque()
-        self.connectivity[name] = set()
+        insort(self._sorted_nodes, name)
+        self.events[name] = deque(maxlen=self.history)
+        self.connectivity_mask[name] = 0
         self.states[name] = None
+        self._dirty_nodes.add(name)
 
     def parse_line(self, line):
-        parts = line.split(',', 2)
-        if len(parts) < 2:
+        """Apply one CSV line from sim_output.log."""
+        ts_s, sep, rest = line.partition(',')
+        if not sep:
+            return
+        ev, _, payload = rest.partition(',')
+        handler = self._handlers.get(ev)
+        if handler is None:
             return
-        ts_s, ev = parts[0], parts[1]
         try:
             ts = float(ts_s)
         except ValueError:
             return
-        if ev == 'initialized':
-            name = parts[2]
-            self.add_node(name)
+        split, on_event = handler
+        fields = split(payload)
+        if fields is not None:
+            on_event(ts, *fields)
+
+    def apply(self, ev, ts, fields):
+        """Apply one already-parsed event, e.g. published in-process by sim.py."""
+        handler = self._handlers.get(ev)
+        if handler is not None:
+            handler[1](ts, *fields)
+
+    def _split_initialized(self, rest):
+        return (rest,) if rest else None
+
+    def _split_connectivity(self, rest):
+        return (rest,)
+
+    def _split_tx(self, rest):
+        return (rest.partition(',')[0],)
+
+    def _split_forward(self, rest):
+        src, sep, tail = rest.partition(',')
+        if not sep:
+            return None
+        return (src, tail.partition(',')[0])
+
+    def _split_state(self, rest):
+        dst, sep, state_str = rest.partition(',')
+        if not sep:
+            return None
+        return (dst, state_str)
+
+    def _on_initialized(self, ts, name):
+        self.add_node(name)
+
+    def _on_connectivity(self, ts, matrix):
+        N = len(self.nodes)
+        matrix = matrix[:N*N]
+        if len(matrix) < N * N:
             return
-        if ev == 'connectivity_update':
-            matrix = parts[2]
-            N = len(self.nodes)
-            for i, src in enumerate(self.nodes):
-                for j, dst in enumerate(self.nodes):
-                    if matrix[i*N + j] == '1':
-                        self.connectivity[dst].add(src)
-                    else:
-                        self.connectivity[dst].discard(src)
-        elif ev == 'tx':
-            fields = parts[2].split(',', 1)
-            if len(fields) < 1:
-                return
-            src = fields[0]
-            self.events[src].append((ts, 'TX', 'TX'))
-        elif ev == 'forward':
-            fields = parts[2].split(',', 2)
-            if len(fields) < 2:
-                return
-            src, dst = fields[0], fields[1]
-            self.events[dst].append((ts, 'RX', src))
-        elif ev == 'state':
-            rest = parts[2].split(',', 1)
-            if len(rest) < 2:
-                return
-            dst, state_str = rest
-            sp = state_str.split(',')
-            if not sp or sp[0] != 'get_state':
-                return
-            uptime = sp[1]
-            entries = sp[2:]
-            node_list = []
-            for i in range(len(entries) // 4):
-                name_i, ts_i, lat_i, lon_i = entries[4*i:4*i+4]
-                node_list.append((name_i, ts_i, lat_i, lon_i))
-            self.states[dst] = {'uptime': uptime, 'entries': node_list}
+        if (N, matrix) == self._prev_matrix:
+            return
+        self._prev_matrix = (N, matrix)
+        for j, mask in self._column_masks(matrix, N):
+            dst = self.nodes[j]
+            if mask ^ self.connectivity_mask[dst]:
+                self.connectivity_mask[dst] = mask
+                self._peers_cache.pop(dst, None)
+                self._dirty_nodes.add(dst)
 
-    def generate_view(self):
-        if self.mode == 'state':
-            return self.generate_state_view()
-        panels = []
-        for n in sorted(self.nodes):
-            text = Text()
-            peers = sorted(self.connectivity.get(n, []))
+    def _on_tx(self, ts, src, *_):
+        src = self._names.get(src)
+        if src is None:
+            return
+        self.events[src].append((ts, 'TX', 'TX'))
+        self._dirty_nodes.add(src)
+
+    def _on_forward(self, ts, src, dst, *_):
+        dst = self._names.get(dst)
+        if dst is None:
+            return
+        src = self._names.get(src, src)
+        self.events[dst].append((ts, 'RX', src))
+        self._dirty_nodes.add(dst)
+
+    def _on_state(self, ts, dst, state_str):
+        dst = self._names.get(dst)
+        if dst is None:
+            return
+        sp = state_str.split(',')
+        if not sp or sp[0] != 'get_state':
+            return
+        uptime = sp[1]
+        it = iter(sp[2:])
+        node_list = list(zip(it, it, it, it))
+        self.states[dst] = {'uptime': uptime, 'entries': node_list}
+        self._dirty_nodes.add(dst)
+
+    def _column_masks(self, matrix, N):
+        """
+        Decode an N*N row-major matrix string into
+        (j, mask) pairs, mask having bit i set when row i reaches column j.
+        With numpy only columns that differ from the previous matrix are returned.
+        """
+        if numpy is None:
+            bits = matrix.encode('ascii', 'replace').translate(_BIT_DIGITS)
+            return [(j, int(bits[j:N*N:N][::-1], 2)) for j in range(N)]
+        arr = numpy.frombuffer(matrix.encode('ascii', 'replace'),
+                               dtype=numpy.uint8).reshape(N, N) == ord('1')
+        prev = self._conn_arr
+        self._conn_arr = arr
+        if prev is None or prev.shape != arr.shape:
+            changed = numpy.arange(N)
+        else:
+            changed = numpy.flatnonzero((arr ^ prev).any(axis=0))
+        packed = numpy.packbits(arr[:, changed].T, axis=1, bitorder='little')
+        return [(int(j), int.from_bytes(row.tobytes(), 'little'))
+                for j, row in zip(changed, packed)]
+
+    def _peers_in(self, n):
+        peers = []
+        m = self.connectivity_mask.get(n, 0)
+        while m:
+            b = m & -m
+            peers.append(self.nodes[b.bit_length() - 1])
+            m ^= b
+        peers.sort()
+        return peers
+
+    def _peers_line(self, n):
+        line = self._peers_cache.get(n)
+        if line is None:
+            peers = self._peers_in(n)
             peers_str = ", ".join(peers) if peers else "<none>"
-            text.append(f"Peers in: {peers_str}\n", style="cyan")
-            text.append("Last events:\n", style="magenta")
-            for ts, typ, other in list(self.events[n]):
-                arrow = "→" if typ == 'TX' else "←"
-                text.append(f" {ts:6.3f}s {arrow} {other}\n")
-            panels.append(Panel(text, title=n, expand=True))
-        return Columns(panels)
-
-    def generate_state_view(self):
-        panels = []
-        for n in sorted(self.nodes):
-            text = Text()
-            st = self.states.get(n)
-            if st:
-                text.append(f"Uptime: {st['uptime']} ms\n", style="green")
-                peers = sorted(self.connectivity.get(n, []))
-                peers_str = ", ".join(peers) if peers else "<none>"
-                text.append(f"Peers in: {peers_str}\n", style="cyan")
-                text.append("Entries:\n", style="magenta")
-                for name_i, ts_i, lat_i, lon_i in st['entries']:
-                    text.append(f" {name_i}: ts={ts_i}, lat={lat_i}, lon={lon_i}\n")
-            else:
-                text.append("No state yet\n", style="red")
-            panels.append(Panel(text, title=n, expand=True))
-        return Columns(panels)
+            line = self._peers_cache[n] = f"[cyan]Peers in: {escape(peers_str)}[/cyan]"
+        return line
+
+    def has_changes(self):
+        """True if generate_view would produce a different view than last time."""
+        return bool(self._dirty_nodes) or self.mode != self._panel_mode
+
+    def generate_view(self):
+        render = self._state_panel if self.mode == 'state' else self._events_panel
+        if self.mode != self._panel_mode:
+            self._panel_mode = self.mode
+            self._panel_cache.clear()
+            self._dirty_nodes.update(self.nodes)
+        for n in self._dirty_nodes:
+            self._panel_cache[n] = render(n)
+        self._dirty_nodes.clear()
+        return Columns([self._panel_cache[n] for n in self._sorted_nodes])
+
+    def _events_panel(self, n):
+        lines = [self._peers_line(n), "[magenta]Last events:[/magenta]"]
+        for ts, typ, other in self.events[n]:
+            arrow = "→" if typ == 'TX' else "←"
+            lines.append(f" {ts:6.3f}s {arrow} {escape(other)}")
+        lines.append("")
+        return Panel(Text.from_markup("\n".join(lines)), title=n, expand=True)
+
+    def _state_panel(self, n):
+        st = self.states.get(n)
+        if not st:
+            return Panel(Text("No state yet\n", style="red"), title=n, expand=True)
+        lines = [f"[green]Uptime: {escape(st['uptime'])} ms[/green]",
+                 self._peers_line(n),
+                 "[magenta]Entries:[/magenta]"]
+        for name_i, ts_i, lat_i, lon_i in st['entries']:
+            lines.append(escape(f" {name_i}: ts={ts_i}, lat={lat_i}, lon={lon_i}"))
+        lines.append("")
+        return Panel(Text.from_markup("\n".join(lines)), title=n, expand=True)
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description="LoRa network simulator orchestrator")
@@ -350,13 +1008,19 @@ if __name__ == '__main__':
     parser.add_argument('--duration', type=float, default=None,
                         help='Optional simulation duration in seconds')
     parser.add_argument('--monitor', choices=['events', 'state'], default=None,
-                        help='Enable live monitor display using Rich')
+                        help='Enable live monitor display using Rich; sends get_state to every '
+                             f'node every {STATE_POLL_INTERVAL} s to feed it')
+    parser.add_argument('--history', type=int, default=DEFAULT_HISTORY,
+                        help='Number of recent events kept and shown per node in the live monitor')
     parser.add_argument('--spawn-offsets', nargs='+', type=float,
                         help='List of per-node spawn offsets (seconds). Overrides random offsets.')
     parser.add_argument('--spawn-max', type=float, default=5.0,
                         help='Maximum random spawn offset (seconds)')
     parser.add_argument('--seed', type=int, default=0,
                         help='Random seed for spawn offsets when not provided')
+    parser.add_argument('--raw-logs', action='store_true',
+                        help='Write all node output to one binary nodes.bin with raw ns ticks '
+                             'instead of per-node text logs (render with render_log.py)')
     args = parser.parse_args()
 
     # Interactive simulation: prompt for connectivity, spawn nodes, and accept live node_update via keys
@@ -390,12 +1054,10 @@ if __name__ == '__main__':
         print(line0, file=sys.__stdout__)
         sim_log.write(line0 + "\n")
         # Prepare simulation start and apply connectivity matrix
-        start_time = time.time()
-        dispatcher = Dispatcher(args.nodes)
-        N = len(args.nodes)
-        for i, src in enumerate(args.nodes):
-            for j, dst in enumerate(args.nodes):
-                dispatcher.conn[src][dst] = (matrix_str[i*N + j] == '1')
+        start_time = time.perf_counter()
+        raw_log = RawNodeLog(os.path.join(args.outdir, 'nodes.bin'), start_time) if args.raw_logs else None
+        dispatcher = Dispatcher(args.nodes, EventBus(), raw_log)
+        dispatcher.set_matrix(matrix_str)
         # No nodes spawned yet; wait for keypress to spawn or update
         nodes = {}
         # Live key loop for node_update events
@@ -405,17 +1067,16 @@ if __name__ == '__main__':
         tty.setcbreak(fd)
         try:
             while True:
-                dr, _, _ = select.select([sys.stdin], [], [], 0.1)
-                if not dr:
-                    continue
-                ch = sys.stdin.read(1)
-                if ch == '\x1b':  # ESC
+                # block until a key arrives; read the fd so no keys sit unseen
+                # in the text layer's buffer
+                ch = os.read(fd, 1)
+                if not ch or ch == b'\x1b':  # EOF or ESC
                     break
                 if ch.isdigit():
                     idx = int(ch) - 1
                     if 0 <= idx < len(args.nodes):
                         name = args.nodes[idx]
-                        t = time.time() - start_time
+                        t = time.perf_counter() - start_time
                         tsf = f"{t:.3f}"
                         if name not in nodes:
                             # First press: spawn node
@@ -458,6 +1119,8 @@ if __name__ == '__main__':
         # Terminate nodes
         for np in nodes.values():
             np.terminate()
+        # final flush of the event and node logs
+        dispatcher.log_flusher.stop()
         print("Simulation terminated.", file=sys.__stdout__)
         # Close input file for reproducibility
         try:
@@ -467,16 +1130,23 @@ if __name__ == '__main__':
         sim_log.close()
         sys.exit(0)
     log_path = os.path.join(args.outdir, 'sim_output.log')
-    sim_log = open(log_path, 'w', buffering=1)
+    sim_log = open(log_path, 'w')
     # Determine output streams: in monitor mode, send CSV only to log; otherwise, also to console
     if args.monitor:
         sys.stdout = Tee(sim_log)
     else:
+        # a terminal stdout is line-buffered, i.e. one write per event; leave
+        # the flushing to the LogFlusher like sim_output.log
+        sys.stdout.reconfigure(line_buffering=False)
         sys.stdout = Tee(sys.stdout, sim_log)
 
     # Prepare simulation
-    start_time = time.time()
-    dispatcher = Dispatcher(args.nodes)
+    start_time = time.perf_counter()
+    bus = EventBus()
+    raw_log = RawNodeLog(os.path.join(args.outdir, 'nodes.bin'), start_time) if args.raw_logs else None
+    dispatcher = Dispatcher(args.nodes, bus, raw_log)
+    # Attach before any event is published so the monitor sees the whole run
+    monitor_q = bus.attach_monitor() if args.monitor else None
 
     # Determine spawn offsets (absolute seconds since start)
     if args.spawn_offsets:
@@ -491,69 +1161,98 @@ if __name__ == '__main__':
     # Spawn nodes at specified offsets (sorted by offset)
     schedule = sorted(zip(offsets, args.nodes), key=lambda x: x[0])
     nodes = {}
-    for offset, name in schedule:
-        now = time.time() - start_time
-        to_sleep = offset - now
-        if to_sleep > 0:
-            time.sleep(to_sleep)
-        np = NodeProc(name, args.node_exe, args.outdir, start_time, dispatcher)
-        dispatcher.register(np)
-        # Log node initialization event
-        ts_init = np._timestamp()
-        print(f"{ts_init:.3f},initialized,{name}", flush=True)
-        nodes[name] = np
-
-    # Load events
-    events = load_events(args.input)
-
-    # Loader thread
-    def loader():
-        for ts, dest, data in events:
-            # wait until ts
-            now = time.time() - start_time
-            to_sleep = ts - now
+    spawn = lambda name: NodeProc(name, args.node_exe, args.outdir, start_time, dispatcher)
+    with ThreadPoolExecutor(max_workers=min(len(schedule), SPAWN_WORKERS) or 1) as pool:
+        i = 0
+        while i < len(schedule):
+            to_sleep = schedule[i][0] - (time.perf_counter() - start_time)
             if to_sleep > 0:
                 time.sleep(to_sleep)
-            # dispatch
-            if dest == '-1':
+            # Every node that is due by now forks in parallel rather than
+            # queueing behind the others' Popen
+            now = time.perf_counter() - start_time
+            due = []
+            while i < len(schedule) and schedule[i][0] <= now:
+                due.append(schedule[i][1])
+                i += 1
+            # map() yields in submission order, keeping the log deterministic
+            for np in pool.map(spawn, due):
+                dispatcher.register(np)
+                # Log node initialization event
+                bus.publish('initialized', np._timestamp(), np.name)
+                nodes[np.name] = np
+
+    # Emit node state for the monitor at a fixed cadence; it is the only
+    # consumer, and the polls are commands the nodes see
+    if args.monitor:
+        dispatcher.start_state_poller()
+
+    # Load events; the mux thread dispatches them as they come due
+    def dispatch(dest, batch):
+        if dest == '-1':
+            for ts, data in batch:
                 dispatcher.update_connectivity(data, ts)
-            else:
-                np = nodes.get(dest)
-                if np:
-                    np.send_command(data)
-                    # log overall
-                    print(f"{ts:.3f},send_command,{dest},{data}")
-                else:
-                    print(f"Unknown destination '{dest}' at ts {ts}", file=sys.stderr)
-    loader_thread = threading.Thread(target=loader, daemon=True)
-    loader_thread.start()
+            return
+        np = nodes.get(dest)
+        if np is None:
+            print(f"Unknown destination '{dest}' at ts {batch[0][0]}", file=sys.stderr)
+            return
+        np.send_commands([cmd for _, cmd in batch])
+        # log overall
+        for cmd_ts, cmd in batch:
+            bus.publish('send_command', cmd_ts, dest, cmd)
+    eq = EventQueue(load_events(args.input), dispatcher.io, start_time, dispatch)
+    eq.start()
 
     # Listen for Escape key to stop simulation and jump to get_state
     stop_event = threading.Event()
     # Start live monitor if requested
+    monitor_thread = None
     if args.monitor:
-        mon = Monitor()
+        mon = Monitor(history=args.history)
         mon.mode = args.monitor
         def monitor_loop():
-            with Live(mon.generate_view(), refresh_per_second=4, screen=True) as live:
-                for line in tail_f(log_path):
-                    if stop_event.is_set():
-                        break
-                    mon.parse_line(line)
-                    live.update(mon.generate_view())
-        threading.Thread(target=monitor_loop, daemon=True).start()
+            refresh_interval = 1.0 / REFRESH_PER_SECOND
+            # sys.stdout is the CSV Tee here; draw on the real terminal and
+            # leave sys.stdout alone so events keep going to sim_output.log
+            console = Console(file=sys.__stdout__)
+            with Live(mon.generate_view(), console=console, redirect_stdout=False,
+                      refresh_per_second=REFRESH_PER_SECOND, screen=True) as live:
+                while not stop_event.is_set():
+                    # sleep until an event is published (None wakes us to exit),
+                    # apply everything queued, then redraw at most once per refresh
+                    try:
+                        item = monitor_q.get(timeout=1.0)
+                    except queue.Empty:
+                        continue
+                    while item is not None:
+                        mon.apply(*item)
+                        try:
+                            item = monitor_q.get_nowait()
+                        except queue.Empty:
+                            item = None
+                    if mon.has_changes():
+                        live.update(mon.generate_view())
+                    stop_event.wait(refresh_interval)
+        monitor_thread = threading.Thread(target=monitor_loop, daemon=True)
+        monitor_thread.start()
     if sys.stdin.isatty():
         fd = sys.stdin.fileno()
         orig_settings = termios.tcgetattr(fd)
         tty.setcbreak(fd)
+        # the listener blocks on stdin and this self-pipe; shutdown writes to it
+        esc_stop_r, esc_stop_w = os.pipe()
         def esc_listener():
-            while not stop_event.is_set():
-                dr, _, _ = select.select([sys.stdin], [], [], 0.1)
-                if dr:
-                    ch = sys.stdin.read(1)
-                    if ch == '\x1b':
-                        stop_event.set()
-                        break
+            while True:
+                dr, _, _ = select.select([fd, esc_stop_r], [], [])
+                if esc_stop_r in dr:
+                    return
+                ch = os.read(fd, 1)
+                if not ch:
+                    return
+                if ch == b'\x1b':
+                    stop_event.set()
+                    return
         threading.Thread(target=esc_listener, daemon=True).start()
     try:
         if args.duration is not None:
@@ -566,9 +1265,20 @@ if __name__ == '__main__':
     finally:
         # Restore terminal settings if modified
         if sys.stdin.isatty():
+            os.write(esc_stop_w, b'x')
             termios.tcsetattr(sys.stdin.fileno(), termios.TCSADRAIN, orig_settings)
 
+    dispatcher.stop_state_poller()
+    eq.close()
+    # Tear down the live display before printing the summary
+    stop_event.set()
+    if monitor_thread is not None:
+        monitor_q.put(None)
+        monitor_thread.join(timeout=1.0)
+
     # -- Final state dump --
+    # Write out buffered events before printing around them
+    bus.flush()
     # Restore stdout to console for final summary if in monitor mode
     if args.monitor:
         sys.stdout = sys.__stdout__
@@ -591,4 +1301,7 @@ if __name__ == '__main__':
     # Terminate nodes
     for np in nodes.values():
         np.terminate()
+    # final flush of the event and node logs
+    dispatcher.log_flusher.stop()
+    sim_log.flush()
     print("Simulation terminated.")
\ No newline at end of file